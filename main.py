@@ -1,39 +1,340 @@
 from astrbot.api.all import *
 from astrbot.core.log import LogManager  # 使用 LogManager 获取 logger
 import os
+import sys
 import json
-import shlex
+import logging
+import asyncio
+import atexit
+import threading
+import weakref
+from dataclasses import dataclass
+
+# 优先使用 orjson（C/Rust 实现，直接输出 UTF-8 bytes），未安装时退回标准库 json
+try:
+    import orjson
+
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf8")
+
+    _json_loads = json.loads
+
+
+def _split_commands(s):
+    '''
+    一次扫描把 alias.add 的参数切分为命令列表：按空白分词并去掉引号（反斜杠转义其后的字符），
+    遇到以未加引号的 "/" 开头的词时开始一条新命令，同一命令内的词以单个空格连接。
+    '''
+    commands = []
+    words = []  # 当前命令中已读完的词
+    chars = []  # 正在读取的词
+    in_word = False
+    quote = None
+    escaped = False
+    for ch in s:
+        if escaped:
+            # 与 shlex 一致：双引号内的反斜杠只转义双引号和反斜杠本身
+            if quote == '"' and ch not in '"\\':
+                chars.append("\\")
+            chars.append(ch)
+            escaped = False
+        elif ch == "\\" and quote != "'":
+            escaped = in_word = True
+        elif quote:
+            if ch == quote:
+                quote = None
+            else:
+                chars.append(ch)
+        elif ch == '"' or ch == "'":
+            quote = ch
+            in_word = True
+        elif ch.isspace():
+            if in_word:
+                # 空引号 "" 不产生词，避免命令中出现多余空格或整条空命令
+                if chars:
+                    words.append("".join(chars))
+                    chars.clear()
+                in_word = False
+        else:
+            if not in_word and ch == "/" and words:
+                command = " ".join(words).strip()
+                if command:
+                    commands.append(command)
+                words = []
+            chars.append(ch)
+            in_word = True
+    if in_word and chars:
+        words.append("".join(chars))
+    command = " ".join(words).strip()
+    if command:
+        commands.append(command)
+    return commands
+
+
+@dataclass(slots=True)
+class Alias:
+    '''
+    单个别名记录。只保存预编译的命令模板：不含 "{args}" 的命令保存原字符串，
+    含 "{args}" 的命令保存按其切分后的片段元组；原命令列表在展示与持久化时再还原。
+    '''
+    name: str
+    templates: list
+
+    def __post_init__(self):
+        # 驻留别名名称，添加、加载与日志回放中的名称比较可走指针相等的快速路径
+        self.name = sys.intern(self.name)
+
+    @staticmethod
+    def _compile(commands):
+        return [tuple(cmd.split("{args}")) if "{args}" in cmd else cmd for cmd in commands]
+
+    @classmethod
+    def from_commands(cls, name, commands):
+        return cls(name, cls._compile(commands))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls.from_commands(data.get("name", ""), data.get("commands", []))
+
+    @property
+    def commands(self):
+        return [tmpl if isinstance(tmpl, str) else "{args}".join(tmpl) for tmpl in self.templates]
+
+    @commands.setter
+    def commands(self, commands):
+        self.templates = self._compile(commands)
+
+    def to_dict(self):
+        return {"name": self.name, "commands": self.commands}
+
 
 @register("alias_service", "w33d", "别名管理插件", "1.0.0", "https://github.com/Last-emo-boy/astrbot_plugin_aliases")
 class AliasService(Star):
     def __init__(self, context):
         super().__init__(context)
         self.logger = LogManager.GetLogger("AliasService")
-        # 存储文件路径：当前插件目录下 alias_store.json
+        # 缓存日志级别判断，关闭 DEBUG 时消息热路径不再格式化调试字符串
+        self._debug = self.logger.isEnabledFor(logging.DEBUG)
+        # 存储文件路径：当前插件目录下 alias_store.json（完整快照）与 alias_store.journal（追加日志）
         self.alias_file = os.path.join(os.path.dirname(__file__), "alias_store.json")
-        self._store = self.load_alias_store()  # 别名数据：列表，每个元素为 {"name": str, "commands": [str, ...]}
+        self.journal_file = os.path.join(os.path.dirname(__file__), "alias_store.journal")
+        self._journal_len = 0  # 日志中尚未合并进快照的条目数
+        self._journal_torn = False  # 日志中有无法解析的行（如崩溃时写了一半），需要立即合并
+        self._pending_journal = []  # 尚未落盘的日志条目，由后台写入任务批量写出
+        self._dirty = asyncio.Event()
+        self._writer_task = None
+        self._io_lock = threading.RLock()  # 后台线程与 alias.compact 可能同时写文件
+        # 进程直接退出时（未经插件卸载）也写出尚未落盘的变更
+        atexit.register(self._flush_journal)
+        # 别名数据延迟到首次使用时再读盘，避免拖慢机器人启动
+        self._loaded = False
+        self._store = {}  # 别名数据：{名称: Alias}，保持添加顺序
+        self._trie = {}  # 别名前缀树：每个节点为 {字符: 子节点, "_leaf": 别名}
+        self._list_cache = None  # alias.list 的输出，别名变更时置空
+        self._processed_ids = set()  # 由别名展开产生的事件的 id，事件被回收时自动移除
+        self._event_queue = None  # 首次展开别名时从 context 获取并缓存
         self.alias_groups = {}
 
+    def _open_store_file(self, path):
+        # 直接尝试打开，文件不存在时返回 None，省去先 exists 再 open 的两次系统调用与竞态
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.error(f"打开别名存储文件 {path} 失败：{e}")
+            return None
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._store = self.load_alias_store()
+        self._rebuild_index()
+        self._loaded = True
+        if self._journal_torn:
+            # 交给后台写入任务用已恢复的数据重写快照并删除日志，否则后续追加会接在残行之后，重启时一并丢失
+            self._schedule_flush()
+
     def load_alias_store(self):
-        if os.path.exists(self.alias_file):
+        '''读取快照后按顺序回放追加日志，得到最新的别名数据'''
+        snapshot = self._open_store_file(self.alias_file)
+        journal = self._open_store_file(self.journal_file)
+        try:
+            return self._read_alias_store(snapshot, journal)
+        finally:
+            for f in (snapshot, journal):
+                if f is not None:
+                    f.close()
+
+    def _read_alias_store(self, snapshot, journal):
+        store = {}
+        if snapshot is not None:
             try:
-                with open(self.alias_file, "r", encoding="utf8") as f:
-                    data = json.load(f)
-                    self.logger.debug("成功加载别名存储文件。")
-                    return data
+                for data in _json_loads(snapshot.read()):
+                    alias = Alias.from_dict(data)
+                    store[alias.name] = alias
+                self.logger.debug("成功加载别名存储文件。")
             except Exception as e:
                 self.logger.error(f"加载别名存储失败：{e}")
-                return []
-        else:
-            return []
+        if journal is not None:
+            # 逐行回放，跳过无法解析的行：崩溃时最后一行可能只写了一半
+            for line in journal:
+                if not line.endswith(b"\n"):
+                    # 末行缺少换行，下次追加会与之粘连，同样需要合并
+                    self._journal_torn = True
+                if not line.strip():
+                    continue
+                try:
+                    self._apply_journal_entry(store, _json_loads(line))
+                except Exception as e:
+                    self.logger.error(f"回放别名日志失败，跳过该行：{e}")
+                    self._journal_torn = True
+                    continue
+                self._journal_len += 1
+            self.logger.debug("成功回放 %d 条别名日志。", self._journal_len)
+        return store
+
+    @staticmethod
+    def _apply_journal_entry(store, entry):
+        name = entry.get("name")
+        if entry.get("op") == "add":
+            alias = store.get(name)
+            if alias is not None:
+                alias.commands = entry["commands"]
+            else:
+                store[name] = Alias.from_commands(name, entry["commands"])
+        elif entry.get("op") == "remove":
+            store.pop(name, None)
+
+    def _append_journal(self, entry):
+        '''记录一条变更，由后台任务稍后合并写盘，命令处理中不做同步文件 I/O'''
+        self._pending_journal.append(entry)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        self._dirty.set()
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._writer_loop())
+
+    async def _writer_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._dirty.wait()
+            # 等变更停止 0.5 秒后再写盘，连续的变更只产生一次写入；最多推迟 5 秒
+            deadline = loop.time() + 5
+            while self._dirty.is_set() and loop.time() < deadline:
+                self._dirty.clear()
+                await asyncio.sleep(0.5)
+            self._dirty.clear()
+            await asyncio.to_thread(self._flush_journal)
+
+    def _flush_journal(self):
+        '''把待写入的条目一次追加到日志；日志有残行或条目超过别名数两倍时改为写出新快照'''
+        with self._io_lock:
+            if not self._pending_journal and not self._journal_torn:
+                return
+            if self._journal_torn or self._journal_len + len(self._pending_journal) > 2 * max(len(self._store), 8):
+                # 快照自行取走待写条目，失败时放回，留待下次重试
+                self.save_alias_store()
+                return
+            entries, self._pending_journal = self._pending_journal, []
+            try:
+                # 一批条目拼成一个 bytes 一次写入并 fsync，避免多次小写入与断电丢失
+                payload = b"".join(_json_dumps(entry) + b"\n" for entry in entries)
+                with open(self.journal_file, "ab") as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal_len += len(entries)
+            except Exception as e:
+                self.logger.error(f"写入别名日志失败：{e}")
+                self._pending_journal[:0] = entries  # 留待下次重试
+
+    async def terminate(self):
+        '''插件卸载时停止后台写入任务，并同步写出尚未落盘的变更'''
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
+        self._flush_journal()
+        # 仅在全部写出后才注销退出钩子；写入失败时保留，进程退出前再重试一次
+        if not self._pending_journal:
+            atexit.unregister(self._flush_journal)
 
     def save_alias_store(self):
-        try:
-            with open(self.alias_file, "w", encoding="utf8") as f:
-                json.dump(self._store, f, ensure_ascii=False, indent=4)
-            self.logger.debug("成功保存别名存储文件。")
-        except Exception as e:
-            self.logger.error(f"保存别名存储失败：{e}")
+        '''写出完整快照并清空追加日志，返回是否成功'''
+        with self._io_lock:
+            self._ensure_loaded()  # 未加载时写出的空快照会覆盖已有数据
+            # 先取走待写条目再序列化：快照已包含它们，之后产生的变更仍会进入新日志
+            taken, self._pending_journal = self._pending_journal, []
+            try:
+                # list() 在 C 层一次性取出，避免事件循环同时增删别名时迭代出错
+                data = [alias.to_dict() for alias in list(self._store.values())]
+                # 先写临时文件再原子替换，写到一半崩溃也不会损坏原快照；文件只供程序读取，不缩进
+                tmp_file = self.alias_file + ".tmp"
+                with open(tmp_file, "wb") as f:
+                    f.write(_json_dumps(data))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self.alias_file)
+                # 快照落盘后再删除日志；两步之间崩溃时回放的都是幂等操作，结果不变
+                try:
+                    os.remove(self.journal_file)
+                except FileNotFoundError:
+                    pass
+                self._journal_len = 0
+                self._journal_torn = False
+                self.logger.debug("成功保存别名存储文件。")
+                return True
+            except Exception as e:
+                self.logger.error(f"保存别名存储失败：{e}")
+                self._pending_journal[:0] = taken  # 快照未写成，放回待写条目
+                return False
+
+    def _rebuild_index(self):
+        self._trie = {}
+        for alias in self._store.values():
+            self._trie_insert(alias)
+
+    def _trie_insert(self, alias):
+        node = self._trie
+        for ch in alias.name:
+            node = node.setdefault(ch, {})
+        node["_leaf"] = alias
+
+    def _trie_remove(self, name):
+        path = []
+        node = self._trie
+        for ch in name:
+            child = node.get(ch)
+            if child is None:
+                return
+            path.append((node, ch))
+            node = child
+        node.pop("_leaf", None)
+        # 自底向上剪掉已经为空的分支
+        while path and not node:
+            parent, ch = path.pop()
+            del parent[ch]
+            node = parent
+
+    def _match_alias(self, message, node):
+        '''
+        从消息首字符对应的前缀树节点 node 继续向下查找最长别名前缀，
+        返回 (别名, 别名长度)，未匹配时返回 (None, 0)
+        '''
+        matched = node.get("_leaf")
+        matched_len = 1 if matched is not None else 0
+        for i in range(1, len(message)):
+            node = node.get(message[i])
+            if node is None:
+                break
+            leaf = node.get("_leaf")
+            if leaf is not None:
+                matched, matched_len = leaf, i + 1
+        return matched, matched_len
 
     @command("alias.switch")
     async def alias_switch(self, event: AstrMessageEvent, *, group: str = None):
@@ -53,7 +354,7 @@ class AliasService(Star):
         channel_data["aliasGroups"] = [group]
         self.context.update_channel_data(session_id, channel_data)
         yield event.plain_result(f"成功切换到别名组 {group}")
-        self.logger.debug(f"频道 {session_id} 已切换到别名组 {group}")
+        self.logger.debug("频道 %s 已切换到别名组 %s", session_id, group)
 
     @command("alias.add")
     async def alias_add(self, event: AstrMessageEvent, alias_name: str, *cmds: str):
@@ -69,95 +370,134 @@ class AliasService(Star):
         if not alias_name or not cmds:
             yield event.plain_result("请提供别名和至少一个命令")
             return
+        self._ensure_loaded()
 
-        # 将 cmds 元组合并为一个字符串，然后用 shlex.split 拆分（以便支持命令中含有空格的情况）
-        command_str = " ".join(cmds)
-        tokens = shlex.split(command_str)
-        commands_list = []
-        current_cmd = ""
-        for token in tokens:
-            if token.startswith("/") and current_cmd:
-                commands_list.append(current_cmd.strip())
-                current_cmd = token
-            else:
-                if current_cmd:
-                    current_cmd += " " + token
-                else:
-                    current_cmd = token
-        if current_cmd:
-            commands_list.append(current_cmd.strip())
-
-        updated = False
-        for alias in self._store:
-            if alias.get("name") == alias_name:
-                alias["commands"] = commands_list
-                updated = True
-                break
-        if updated:
+        # 将 cmds 元组合并为一个字符串后重新切分（以便支持命令中含有空格的情况）
+        commands_list = _split_commands(" ".join(cmds))
+        if not commands_list:
+            yield event.plain_result("请提供别名和至少一个命令")
+            return
+
+        alias = self._store.get(alias_name)
+        if alias is not None and alias.commands == commands_list:
+            # 内容未变，不写日志也不清空列表缓存
+            yield event.plain_result(f"别名 {alias_name} 的命令未变化，未改动")
+            return
+        if alias is not None:
+            alias.commands = commands_list
             yield event.plain_result(f"别名 {alias_name} 已更新")
-            self.logger.debug(f"更新别名 {alias_name}: {commands_list}")
+            self.logger.debug("更新别名 %s: %s", alias_name, commands_list)
         else:
-            self._store.append({
-                "name": alias_name,
-                "commands": commands_list
-            })
+            alias = Alias.from_commands(alias_name, commands_list)
+            self._store[alias.name] = alias
+            self._trie_insert(alias)
             yield event.plain_result(f"成功添加别名 {alias_name}")
-            self.logger.debug(f"新增别名 {alias_name}: {commands_list}")
-        self.save_alias_store()
+            self.logger.debug("新增别名 %s: %s", alias_name, commands_list)
+        self._list_cache = None
+        self._append_journal({"op": "add", "name": alias_name, "commands": commands_list})
 
     @command("alias.remove")
     async def alias_remove(self, event: AstrMessageEvent, *, name: str):
         '''删除别名'''
-        before_count = len(self._store)
-        self._store = [alias for alias in self._store if alias.get("name") != name]
-        if len(self._store) < before_count:
+        self._ensure_loaded()
+        if self._store.pop(name, None) is not None:
+            self._trie_remove(name)
+            self._list_cache = None
             yield event.plain_result(f"成功删除别名 {name}")
-            self.logger.debug(f"删除别名 {name}")
-            self.save_alias_store()
+            self.logger.debug("删除别名 %s", name)
+            self._append_journal({"op": "remove", "name": name})
         else:
             yield event.plain_result(f"别名 {name} 不存在")
 
     @command("alias.list")
     async def alias_list(self, event: AstrMessageEvent):
         '''列出所有别名'''
+        self._ensure_loaded()
         if not self._store:
             yield event.plain_result("当前没有别名")
             return
-        alias_str = "\n".join([f"{alias['name']} -> {' | '.join(alias['commands'])}" for alias in self._store])
-        yield event.plain_result(f"当前别名列表:\n{alias_str}")
+        if self._list_cache is None:
+            alias_str = "\n".join([f"{alias.name} -> {' | '.join(alias.commands)}" for alias in self._store.values()])
+            self._list_cache = f"当前别名列表:\n{alias_str}"
+        yield event.plain_result(self._list_cache)
+
+    @command("alias.compact")
+    async def alias_compact(self, event: AstrMessageEvent):
+        '''将追加日志合并进别名存储文件'''
+        self._ensure_loaded()
+        # 写快照、fsync 与替换文件放到线程中执行，也不在事件循环上等待后台写入持有的锁
+        if await asyncio.to_thread(self.save_alias_store):
+            yield event.plain_result(f"别名存储已合并，共 {len(self._store)} 个别名")
+        else:
+            yield event.plain_result("合并别名存储失败，请查看日志")
 
     @event_message_type(EventMessageType.ALL)
     async def on_message(self, event: AstrMessageEvent):
         '''
         监听所有消息，自动执行别名指令（支持命令组合 & 参数传递）。
-        当检测到消息以已注册的别名开头时：
+        当检测到消息以已注册的别名开头时（多个别名同时匹配时取最长者）：
           1. 调用 event.stop_event() 阻止原始事件后续处理。
           2. 为别名对应的每条命令构造新的 AstrMessageEvent 对象，并注入事件队列供后续命令解析执行。
         '''
-        if getattr(event, '_alias_processed', False):
+        # 派生事件不再参与别名展开；用 id 集合判断，无需读取或注入事件对象的属性
+        if id(event) in self._processed_ids:
             return
 
-        message = event.message_str.strip()
-        self.logger.debug(f"收到消息: {message}")
-
-        for alias in self._store:
-            alias_name = alias.get("name", "")
-            if message.startswith(alias_name):
-                remaining_args = message[len(alias_name):].strip()
-                self.logger.debug(f"匹配到别名 {alias_name}，剩余参数: {remaining_args}")
-                event.stop_event()  # 终止原始事件传播
-
-                for cmd in alias["commands"]:
-                    full_command = (cmd.replace("{args}", remaining_args)
-                                    if "{args}" in cmd
-                                    else f"{cmd} {remaining_args}".strip())
-                    self.logger.debug(f"构造新命令: {full_command}")
-                    new_event = AstrMessageEvent(
-                        message_str = full_command,
-                        message_obj = event.message_obj,
-                        platform_meta = event.platform_meta,
-                        session_id = event.session_id
-                    )
-                    new_event._alias_processed = False
-                    await self.context.get_event_queue().put(new_event)
-                return
+        message = event.message_str
+        if not message:  # 图片、表情等没有文本的消息，最便宜的拒绝放在最前面
+            return
+        if not self._loaded:
+            self._ensure_loaded()
+        # 平台送来的文本通常已去过首尾空白，仅在确有空白时才 strip，省去一次字符串复制
+        if message[0].isspace() or message[-1].isspace():
+            message = message.strip()
+        if self._debug:
+            self.logger.debug(f"收到消息: {message}")
+
+        # 前缀树根节点即按首字符分桶的别名，首字符不在其中的消息不可能匹配，直接返回；
+        # 命中时取出的节点直接交给 _match_alias 继续匹配，首字符只查一次
+        node = self._trie.get(message[:1])
+        if node is None:
+            return
+
+        alias, alias_len = self._match_alias(message, node)
+        if alias is None:
+            return
+
+        alias_name = alias.name
+        # 消息右侧已在开头去过空白，这里只需在参数以空白开头时左去空白
+        remaining_args = message[alias_len:]
+        if remaining_args[:1].isspace():
+            remaining_args = remaining_args.lstrip()
+        if self._debug:
+            self.logger.debug(f"匹配到别名 {alias_name}，剩余参数: {remaining_args}")
+        event.stop_event()  # 终止原始事件传播
+
+        # 循环内不变的属性与方法只查找一次
+        queue = self._event_queue
+        if queue is None:
+            queue = self._event_queue = self.context.get_event_queue()
+        message_obj = event.message_obj
+        platform_meta = event.platform_meta
+        session_id = event.session_id
+        for tmpl in alias.templates:
+            if isinstance(tmpl, str):
+                full_command = f"{tmpl} {remaining_args}" if remaining_args else tmpl
+            else:
+                full_command = remaining_args.join(tmpl)
+            if self._debug:
+                self.logger.debug(f"构造新命令: {full_command}")
+            new_event = AstrMessageEvent(
+                message_str = full_command,
+                message_obj = message_obj,
+                platform_meta = platform_meta,
+                session_id = session_id
+            )
+            new_id = id(new_event)
+            self._processed_ids.add(new_id)
+            weakref.finalize(new_event, self._processed_ids.discard, new_id)
+            # 事件队列通常不设上限，put_nowait 不会让出事件循环；仅在队列已满时退回 await put
+            try:
+                queue.put_nowait(new_event)
+            except asyncio.QueueFull:
+                await queue.put(new_event)